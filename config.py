@@ -1,5 +1,6 @@
 import os
 import logging
+import logging.handlers
 
 # Mistral API Configuration
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
@@ -7,6 +8,26 @@ if not MISTRAL_API_KEY:
     print("Getting ADMIN_MISTRAL_API_KEY from config.py")
     MISTRAL_API_KEY = "ENTER_YOUR_MISTRAL_API_KEY_HERE"
 
+# Receiver Configuration
+# Short plain messages are spoken from a template; set True to always use the AI
+ALWAYS_FORMAT_WITH_AI = False
+PLAIN_MESSAGE_MAX_LENGTH = 160
+
+# Sender Configuration
+# Extraction results are cached on disk so repeated commands skip the AI call
+LLM_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".ai_messenger_cache.sqlite")
+LLM_CACHE_TTL = 7 * 24 * 3600  # 1 week in seconds
+
+# Optional paraphrase cache (requires faiss-cpu and sentence-transformers)
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_INDEX_FILE = os.path.join(
+    os.path.expanduser("~"), ".ai_messenger_cache.faiss"
+)
+SEMANTIC_CACHE_DATA_FILE = os.path.join(
+    os.path.expanduser("~"), ".ai_messenger_cache.json"
+)
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
 # Database Configuration
 DATABASE = "ai_messenger.db"
 
@@ -46,10 +67,16 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 file_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
 
+# Buffer file writes into batches; flushed when full, on errors and at exit
+buffered_file_handler = logging.handlers.MemoryHandler(
+    capacity=256, flushLevel=logging.ERROR, target=file_handler
+)
+buffered_file_handler.setLevel(LOG_LEVEL)
+
 # Configure root logger
 root_logger = logging.getLogger()
 root_logger.setLevel(LOG_LEVEL)
-root_logger.addHandler(file_handler)
+root_logger.addHandler(buffered_file_handler)
 root_logger.addHandler(console_handler)
 
 logger = logging.getLogger(__name__)
@@ -1,45 +1,272 @@
 import sqlite3
 import hashlib
+import hmac
 import secrets
+import threading
+import atexit
+import queue
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import logging
+from cachetools import TTLCache
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from config import DATABASE, logger
 
+# Argon2id parameters (OWASP recommended profile)
+_ph = PasswordHasher(
+    time_cost=2, memory_cost=46 * 1024, parallelism=1, hash_len=32, salt_len=16
+)
+
+
+# SQL statements (constant strings so the connection's statement cache hits)
+_Q_INSERT_USER = "INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)"
+_Q_GET_USER = "SELECT id, password_hash FROM users WHERE username = ? AND is_active = 1"
+_Q_GET_USER_PROFILE = (
+    "SELECT id, username, email, created_at, last_login FROM users WHERE username = ?"
+)
+_Q_UPDATE_PASSWORD_HASH = "UPDATE users SET password_hash = ? WHERE id = ?"
+_Q_UPDATE_LAST_LOGIN = "UPDATE users SET last_login = ? WHERE id = ?"
+_Q_INSERT_SESSION = "INSERT INTO sessions (user_id, token) VALUES (?, ?)"
+_Q_SESSION_USER = """
+    SELECT u.id, u.username, u.email, u.created_at, u.last_login
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    WHERE s.token = ? AND s.is_valid = 1 AND u.is_active = 1
+      AND (s.expires_at IS NULL OR s.expires_at > CURRENT_TIMESTAMP)
+"""
+_Q_INVALIDATE_SESSION = "UPDATE sessions SET is_valid = 0 WHERE token = ?"
+_Q_INSERT_MESSAGE = """
+    INSERT INTO messages (sender_id, recipient_id, message, created_at)
+    VALUES (?, ?, ?, ?)
+"""
+_Q_INSERT_ACTIVITY = (
+    "INSERT INTO activity_logs (user_id, action, details, ip_address, status) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+# Recently verified session tokens -> user row
+_session_cache = TTLCache(maxsize=10_000, ttl=30)
+_session_cache_lock = threading.RLock()
+
+# Recently looked-up usernames -> user profile row
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+_user_cache_lock = threading.RLock()
+
+
+# One reusable connection per thread
+_local = threading.local()
+
+# Per-connection settings (journal_mode=WAL is persistent and set in init_db)
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+)
+
 
 def get_db_connection():
-    """Create database connection with row factory"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """Get this thread's pooled database connection with row factory"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DATABASE,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
     return conn
 
 
+def close_db_connection():
+    """Close this thread's pooled database connection"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def fetch_tuples(sql, params=()):
+    """Run a query on this thread's connection and return rows as plain tuples"""
+    cursor = get_db_connection().cursor()
+    cursor.row_factory = None
+    return cursor.execute(sql, params).fetchall()
+
+
+def release_db_connection(exception=None):
+    """Roll back any transaction left open on this thread's pooled connection"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+atexit.register(close_db_connection)
+
+
+@contextmanager
+def transaction(conn):
+    """Run the enclosed statements in one transaction (single commit)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Activity logs are queued and written in batches by a background thread
+ACTIVITY_BATCH_SIZE = 128
+ACTIVITY_FLUSH_INTERVAL = 0.2  # seconds
+ACTIVITY_QUEUE_SIZE = 10000  # oldest rows are dropped beyond this
+
+_activity_queue = queue.Queue(maxsize=ACTIVITY_QUEUE_SIZE)
+_activity_writer = None
+_STOP = object()
+
+
+def _write_activity_rows(rows):
+    """Insert a batch of activity log rows in a single transaction"""
+    conn = get_db_connection()
+    with transaction(conn):
+        conn.executemany(_Q_INSERT_ACTIVITY, rows)
+
+
+def _enqueue_activity(row):
+    """Queue an activity log row, dropping the oldest one if the queue is full"""
+    while True:
+        try:
+            _activity_queue.put_nowait(row)
+            return
+        except queue.Full:
+            try:
+                _activity_queue.get_nowait()
+                logger.warning("Activity log queue full - dropped oldest entry")
+            except queue.Empty:
+                pass
+
+
+def _activity_writer_loop():
+    """Drain queued activity logs every flush interval or batch size"""
+    running = True
+    while running:
+        rows = []
+        item = _activity_queue.get()
+        deadline = time.monotonic() + ACTIVITY_FLUSH_INTERVAL
+
+        while True:
+            if item is _STOP:
+                running = False
+                break
+            rows.append(item)
+            if len(rows) >= ACTIVITY_BATCH_SIZE:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _activity_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+        if rows:
+            try:
+                _write_activity_rows(rows)
+            except Exception as e:
+                logger.error(f"Activity logging error: {e}")
+
+    close_db_connection()
+
+
+def start_activity_writer():
+    """Start the background activity log writer (once per process)"""
+    global _activity_writer
+
+    if _activity_writer is not None and _activity_writer.is_alive():
+        return
+
+    _activity_writer = threading.Thread(
+        target=_activity_writer_loop, name="activity-writer", daemon=True
+    )
+    _activity_writer.start()
+    atexit.register(stop_activity_writer)
+
+
+def stop_activity_writer(timeout=5):
+    """Flush pending activity logs and stop the writer thread"""
+    global _activity_writer
+
+    if _activity_writer is None:
+        return
+
+    _activity_queue.put(_STOP)
+    _activity_writer.join(timeout)
+    _activity_writer = None
+
+
 def hash_password(password):
-    """Hash password with salt using SHA-256"""
-    salt = secrets.token_hex(32)
+    """Hash password using Argon2id"""
+    return _ph.hash(password)
+
+
+def is_legacy_hash(stored_hash):
+    """Check if stored hash uses the old PBKDF2 salt$hash format"""
+    return not stored_hash.startswith("$argon2")
+
+
+def verify_legacy_password(stored_hash, password):
+    """Verify password against a legacy PBKDF2-SHA256 hash"""
+    salt, hash_val = stored_hash.split("$")
+    # Legacy hashes were derived from the ASCII hex salt, so it must stay encoded
     password_hash = hashlib.pbkdf2_hmac(
-        "sha256", password.encode(), salt.encode(), 100000
+        "sha256", password.encode(), salt.encode(), 100000, dklen=32
     )
-    return f"{salt}${password_hash.hex()}"
+    return hmac.compare_digest(password_hash, bytes.fromhex(hash_val))
 
 
 def verify_password(stored_hash, password):
     """Verify password against stored hash"""
     try:
-        salt, hash_val = stored_hash.split("$")
-        password_hash = hashlib.pbkdf2_hmac(
-            "sha256", password.encode(), salt.encode(), 100000
-        )
-        return password_hash.hex() == hash_val
+        if is_legacy_hash(stored_hash):
+            return verify_legacy_password(stored_hash, password)
+        return _ph.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
     except Exception as e:
         logger.error(f"Password verification error: {e}")
         return False
 
 
+def password_needs_rehash(stored_hash):
+    """Check if stored hash should be upgraded to current Argon2id parameters"""
+    return is_legacy_hash(stored_hash) or _ph.check_needs_rehash(stored_hash)
+
+
+# Columns holding integer Unix millisecond timestamps, and whether their old
+# text values were local time (Python's datetime.now()) rather than UTC
+# (CURRENT_TIMESTAMP)
+_MS_TIMESTAMP_COLUMNS = (
+    ("messages", "created_at", False),
+    ("messages", "read_at", True),
+    ("device_tokens", "registered_at", True),
+)
+
+
 def init_db():
     """Initialize database with required tables"""
     conn = get_db_connection()
 
     try:
+        # WAL lets readers run alongside a writer and is remembered by the file
+        conn.execute("PRAGMA journal_mode=WAL")
+
         # Users table with authentication
         conn.execute(
             """
@@ -64,8 +291,9 @@ def init_db():
                 recipient_id INTEGER NOT NULL,
                 message TEXT NOT NULL,
                 is_read BOOLEAN DEFAULT 0,
-                read_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                read_at INTEGER,
+                created_at INTEGER
+                    DEFAULT (CAST(strftime('%s', 'now') AS INTEGER) * 1000),
                 FOREIGN KEY (sender_id) REFERENCES users(id),
                 FOREIGN KEY (recipient_id) REFERENCES users(id)
             )
@@ -110,7 +338,8 @@ def init_db():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 device_token TEXT NOT NULL,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                registered_at INTEGER
+                    DEFAULT (CAST(strftime('%s', 'now') AS INTEGER) * 1000),
                 last_used TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id),
                 UNIQUE(user_id, device_token)
@@ -118,15 +347,52 @@ def init_db():
         """
         )
 
-        conn.commit()
+        # Message and device times used to be stored as text; convert them once
+        # to integer Unix milliseconds
+        if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            with transaction(conn):
+                for table, column, local_time in _MS_TIMESTAMP_COLUMNS:
+                    modifier = ", 'utc'" if local_time else ""
+                    conn.execute(
+                        f"UPDATE {table} SET {column} = "
+                        f"CAST(strftime('%s', {column}{modifier}) AS INTEGER) * 1000 "
+                        f"WHERE typeof({column}) = 'text'"
+                    )
+                conn.execute("PRAGMA user_version = 1")
+
+        # Unread-message lookups; sessions.token and users.username are
+        # already indexed by their UNIQUE constraints
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_msg_recipient_unread
+            ON messages(recipient_id, is_read, created_at)
+        """
+        )
+
+        # Conversation lookups; both directions of a pair use the same index
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_msg_pair
+            ON messages(sender_id, recipient_id, created_at)
+        """
+        )
+
+        # Contact list (active users ordered by name)
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_active
+            ON users(is_active, username)
+        """
+        )
+
+        start_activity_writer()
+
         logger.info("[SUCCESS] Database initialized successfully!")
         print("[SUCCESS] Database initialized!")
 
     except Exception as e:
         logger.error(f"Database initialization error: {e}")
         print(f"[ERROR] Database initialization error: {e}")
-    finally:
-        conn.close()
 
 
 def register_user(username, password, email=None):
@@ -135,11 +401,9 @@ def register_user(username, password, email=None):
 
     try:
         password_hash = hash_password(password)
-        conn.execute(
-            "INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)",
-            (username, password_hash, email),
-        )
-        conn.commit()
+        conn.execute(_Q_INSERT_USER, (username, password_hash, email))
+        with _user_cache_lock:
+            _user_cache.pop(username, None)
         logger.info(f"User registered successfully: {username}")
         return True, "User registered successfully"
 
@@ -149,8 +413,6 @@ def register_user(username, password, email=None):
     except Exception as e:
         logger.error(f"Registration error: {e}")
         return False, str(e)
-    finally:
-        conn.close()
 
 
 def login_user(username, password):
@@ -158,10 +420,7 @@ def login_user(username, password):
     conn = get_db_connection()
 
     try:
-        user = conn.execute(
-            "SELECT id, password_hash FROM users WHERE username = ? AND is_active = 1",
-            (username,),
-        ).fetchone()
+        user = conn.execute(_Q_GET_USER, (username,)).fetchone()
 
         if not user:
             logger.warning(f"Login failed - user not found: {username}")
@@ -171,17 +430,25 @@ def login_user(username, password):
             logger.warning(f"Login failed - incorrect password: {username}")
             return False, "Invalid credentials", None
 
-        # Update last login
-        conn.execute(
-            "UPDATE users SET last_login = ? WHERE id = ?", (datetime.now(), user["id"])
-        )
+        # Migrate legacy or outdated hashes on successful login
+        new_hash = None
+        if password_needs_rehash(user["password_hash"]):
+            new_hash = hash_password(password)
 
-        # Create session token
+        # Update last login and create session token in one commit
         token = secrets.token_urlsafe(32)
-        conn.execute(
-            "INSERT INTO sessions (user_id, token) VALUES (?, ?)", (user["id"], token)
-        )
-        conn.commit()
+        with transaction(conn):
+            if new_hash:
+                conn.execute(_Q_UPDATE_PASSWORD_HASH, (new_hash, user["id"]))
+            conn.execute(_Q_UPDATE_LAST_LOGIN, (datetime.now(), user["id"]))
+            conn.execute(_Q_INSERT_SESSION, (user["id"], token))
+
+        # Cached profile now has a stale last_login
+        with _user_cache_lock:
+            _user_cache.pop(username, None)
+
+        if new_hash:
+            logger.info(f"Password hash upgraded to Argon2id: {username}")
 
         logger.info(f"User logged in successfully: {username}")
         return True, "Login successful", token
@@ -189,23 +456,22 @@ def login_user(username, password):
     except Exception as e:
         logger.error(f"Login error: {e}")
         return False, str(e), None
-    finally:
-        conn.close()
 
 
 def verify_session_token(token):
     """Verify if session token is valid"""
+    with _session_cache_lock:
+        user = _session_cache.get(token)
+    if user is not None:
+        return True, user
+
     conn = get_db_connection()
 
     try:
-        session = conn.execute(
-            "SELECT user_id FROM sessions WHERE token = ? AND is_valid = 1", (token,)
-        ).fetchone()
-
-        if session:
-            user = conn.execute(
-                "SELECT id, username FROM users WHERE id = ?", (session["user_id"],)
-            ).fetchone()
+        user = conn.execute(_Q_SESSION_USER, (token,)).fetchone()
+        if user:
+            with _session_cache_lock:
+                _session_cache[token] = user
             return True, user
 
         return False, None
@@ -213,42 +479,82 @@ def verify_session_token(token):
     except Exception as e:
         logger.error(f"Session verification error: {e}")
         return False, None
-    finally:
-        conn.close()
 
 
-def log_activity(user_id, action, details=None, ip_address=None, status="success"):
-    """Log user activity"""
+def invalidate_session_token(token):
+    """Invalidate a session token (logout)"""
     conn = get_db_connection()
 
     try:
-        conn.execute(
-            "INSERT INTO activity_logs (user_id, action, details, ip_address, status) VALUES (?, ?, ?, ?, ?)",
-            (user_id, action, details, ip_address, status),
-        )
-        conn.commit()
+        conn.execute(_Q_INVALIDATE_SESSION, (token,))
+        return True
+
+    except Exception as e:
+        logger.error(f"Session invalidation error: {e}")
+        return False
+    finally:
+        with _session_cache_lock:
+            _session_cache.pop(token, None)
+
+
+def log_activity(
+    user_id, action, details=None, ip_address=None, status="success", auto_commit=False
+):
+    """Log user activity (queued unless auto_commit is set or no writer runs)"""
+    row = (user_id, action, details, ip_address, status)
+
+    try:
+        if auto_commit or _activity_writer is None:
+            get_db_connection().execute(_Q_INSERT_ACTIVITY, row)
+        else:
+            _enqueue_activity(row)
         logger.info(
             f"Activity logged - User: {user_id}, Action: {action}, Status: {status}"
         )
 
     except Exception as e:
         logger.error(f"Activity logging error: {e}")
-    finally:
-        conn.close()
+
+
+def record_message(
+    sender_id, recipient_id, message, created_at, details=None, ip_address=None
+):
+    """Store a message and its send_message activity row in one transaction"""
+    conn = get_db_connection()
+
+    try:
+        with transaction(conn):
+            conn.execute(
+                _Q_INSERT_MESSAGE, (sender_id, recipient_id, message, created_at)
+            )
+            conn.execute(
+                _Q_INSERT_ACTIVITY,
+                (sender_id, "send_message", details, ip_address, "success"),
+            )
+        logger.info(f"Activity logged - User: {sender_id}, Action: send_message")
+        return True
+
+    except Exception as e:
+        logger.error(f"Record message error: {e}")
+        return False
 
 
 def get_user_by_username(username):
     """Get user by username"""
+    with _user_cache_lock:
+        user = _user_cache.get(username)
+    if user is not None:
+        return user
+
     conn = get_db_connection()
 
     try:
-        user = conn.execute(
-            "SELECT id, username, email, created_at, last_login FROM users WHERE username = ?", (username,)
-        ).fetchone()
+        user = conn.execute(_Q_GET_USER_PROFILE, (username,)).fetchone()
+        if user:
+            with _user_cache_lock:
+                _user_cache[username] = user
         return user
 
     except Exception as e:
         logger.error(f"Get user error: {e}")
         return None
-    finally:
-        conn.close()
@@ -4,25 +4,12 @@ AI Messenger - Main Entry Point
 A voice-enabled messaging system powered by Mistral AI
 """
 
-import os
 import sys
 import logging
-from datetime import datetime
+import importlib.util
 
-# Configure logging
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-
-log_filename = os.path.join(log_dir, f"messenger_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Importing config sets up the root logger (console + buffered file handler)
+import config
 
 logger = logging.getLogger(__name__)
 
@@ -34,23 +21,15 @@ def check_dependencies():
     """Check if all required dependencies are installed"""
     missing_deps = []
     
-    try:
-        import requests
-    except ImportError:
-        missing_deps.append("requests")
-    
-    try:
-        from mistralai import Mistral
-    except ImportError:
-        missing_deps.append("mistralai")
+    # Only check installation; importing mistralai here would slow startup
+    for package in ("requests", "mistralai"):
+        if importlib.util.find_spec(package) is None:
+            missing_deps.append(package)
     
-    try:
-        import config
-        if not hasattr(config, 'MISTRAL_API_KEY'):
-            print("[WARNING] MISTRAL_API_KEY not found in config.py")
-            logger.warning("MISTRAL_API_KEY not configured")
-    except ImportError:
-        missing_deps.append("config.py (create this file with your MISTRAL_API_KEY)")
+    # config is imported at startup, so only the key itself can be missing
+    if not getattr(config, 'MISTRAL_API_KEY', None):
+        print("[WARNING] MISTRAL_API_KEY not found in config.py")
+        logger.warning("MISTRAL_API_KEY not configured")
     
     if missing_deps:
         print("\n[ERROR] Missing dependencies:")
@@ -58,8 +37,6 @@ def check_dependencies():
             print(f"  - {dep}")
         print("\nInstall missing packages with:")
         print("  pip install requests mistralai")
-        print("\nCreate config.py with:")
-        print('  MISTRAL_API_KEY = "your-api-key-here"')
         return False
     
     return True
@@ -117,7 +94,7 @@ def show_system_info():
     print(f"\n📋 Project: AI Messenger System")
     print(f"🤖 AI Model: Mistral AI (mistral-small-latest)")
     print(f"🌐 Server: http://localhost:5000")
-    print(f"📁 Log File: {log_filename}")
+    print(f"📁 Log File: {config.LOG_FILE}")
     print()
     print("📦 Components:")
     print("  - sender_client.py: Message sending interface")
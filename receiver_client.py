@@ -1,21 +1,57 @@
 import os
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import logging
-from mistralai import Mistral
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import config
-from text_to_speech import text_to_speech
+from text_to_speech import text_to_speech, flush as flush_speech
+from text_to_speech import wait as wait_for_speech
 
 # Configuration
 MISTRAL_API_KEY = config.MISTRAL_API_KEY
 SERVER_URL = "http://localhost:5000"
 logger = logging.getLogger(__name__)
 
+# Pooled HTTP session so server calls reuse keep-alive connections
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.1)
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# Mistral chat API, called through the pooled session above
+MISTRAL_CHAT_URL = "https://api.mistral.ai/v1/chat/completions"
+
+# Fixed instructions; only the sender and message vary per request
+_FORMAT_SYSTEM_PROMPT = (
+    "Format the user's message naturally for spoken output, "
+    'like "<sender> tells <message>". '
+    "Respond ONLY with the formatted message, nothing else."
+)
+
+# Formats upcoming messages while the current one is being spoken
+_format_pool = ThreadPoolExecutor(max_workers=2)
+
+# Live message delivery
+STREAM_READ_TIMEOUT = 60  # seconds; server sends keep-alives every 15 s
+LONG_POLL_WAIT = 30  # seconds
+RECONNECT_DELAY = 5  # seconds
+
 # Session variables
 current_user_token = None
 current_username = None
 
 
+def _json(response):
+    """Decode a JSON response body with orjson"""
+    return orjson.loads(response.content)
+
+
 def authenticate_user():
     """Handle user signup/login"""
     global current_user_token, current_username
@@ -46,7 +82,7 @@ def signup_user():
     try:
         payload = {"username": username, "password": password, "email": email}
 
-        response = requests.post(f"{SERVER_URL}/signup", json=payload, timeout=10)
+        response = _session.post(f"{SERVER_URL}/signup", json=payload, timeout=10)
 
         if response.status_code == 201:
             print("[SUCCESS] Account created successfully!")
@@ -54,7 +90,7 @@ def signup_user():
             # Auto login after signup
             return login_with_credentials(username, password)
         else:
-            error_msg = response.json().get("error", "Signup failed")
+            error_msg = _json(response).get("error", "Signup failed")
             print(f"[ERROR] Signup failed: {error_msg}")
             logger.warning(f"Signup failed: {error_msg}")
             return False
@@ -82,18 +118,19 @@ def login_with_credentials(username, password):
     try:
         payload = {"username": username, "password": password}
 
-        response = requests.post(f"{SERVER_URL}/login", json=payload, timeout=10)
+        response = _session.post(f"{SERVER_URL}/login", json=payload, timeout=10)
 
         if response.status_code == 200:
-            data = response.json()
+            data = _json(response)
             current_user_token = data.get("token")
             current_username = data.get("username")
+            _session.headers["Authorization"] = f"Bearer {current_user_token}"
 
             print(f"\n[SUCCESS] Welcome {current_username}!")
             logger.info(f"User {username} logged in successfully")
             return True
         else:
-            error_msg = response.json().get("error", "Login failed")
+            error_msg = _json(response).get("error", "Login failed")
             print(f"[ERROR] Login failed: {error_msg}")
             logger.warning(f"Login failed for user {username}")
             return False
@@ -103,72 +140,89 @@ def login_with_credentials(username, password):
         return False
 
 
+@lru_cache(maxsize=1024)
+def _format_with_mistral(sender, message):
+    """Ask Mistral AI to format a message (raises on failure so errors aren't cached)"""
+    response = _session.post(
+        MISTRAL_CHAT_URL,
+        json={
+            "model": "mistral-small-latest",
+            "messages": [
+                {"content": _FORMAT_SYSTEM_PROMPT, "role": "system"},
+                {"content": f"Sender: {sender}\nMessage: {message}", "role": "user"},
+            ],
+            "stream": False,
+        },
+        headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"},
+        timeout=10,
+    )
+    response.raise_for_status()
+
+    formatted_message = _json(response)["choices"][0]["message"]["content"].strip()
+    if not formatted_message:
+        raise ValueError("Empty response from Mistral AI")
+    return formatted_message
+
+
 def format_message_with_ai(sender, message):
-    """Use Mistral AI to format the received message naturally"""
+    """Format the received message naturally, using Mistral AI only when needed"""
+
+    # Short plain messages don't need the model
+    if (
+        not config.ALWAYS_FORMAT_WITH_AI
+        and len(message) <= config.PLAIN_MESSAGE_MAX_LENGTH
+        and message.isprintable()
+    ):
+        return f"{sender} says, {message}"
 
     try:
-        with Mistral(api_key=MISTRAL_API_KEY) as mistral:
-            prompt = f"""
-            Format this message naturally for spoken output:
-            Sender: {sender}
-            Message: {message}
-            
-            Create a natural spoken format like: "{sender} tells {message}"
-            Respond ONLY with the formatted message, nothing else.
-            """
-
-            res = mistral.chat.complete(
-                model="mistral-small-latest",
-                messages=[{"content": prompt, "role": "user"}],
-                stream=False,
-            )
-
-            formatted_message = res.choices[0].message.content
-            return formatted_message
+        return _format_with_mistral(sender, message)
     except Exception as e:
         logger.error(f"AI formatting error: {e}")
         return None
 
 
-def check_messages():
-    """Check for new messages from the server"""
+def check_messages(wait=0):
+    """Check for new messages, optionally long-polling; returns (ok, messages)
+
+    messages is None when the session has expired.
+    """
     try:
-        response = requests.get(
-            f"{SERVER_URL}/get_messages?token={current_user_token}", timeout=10
+        response = _session.get(
+            f"{SERVER_URL}/get_messages", params={"wait": wait}, timeout=wait + 10
         )
         if response.status_code == 200:
-            return response.json().get("messages", [])
+            return True, _json(response).get("messages", [])
         elif response.status_code == 401:
             print("[ERROR] Session expired. Please login again.")
             logger.warning("Session token expired")
-            return None
+            return False, None
         else:
-            error_msg = response.json().get("error", "Error fetching messages")
+            error_msg = _json(response).get("error", "Error fetching messages")
             print(f"[ERROR] Error: {error_msg}")
             logger.warning(f"Failed to fetch messages: {error_msg}")
-            return []
+            return False, []
     except Exception as e:
         print(f"[ERROR] Connection error: {e}")
         logger.error(f"Check messages error: {e}")
-        return []
+        return False, []
 
 
-def mark_message_read(message_id):
-    """Mark a message as read on the server"""
+def mark_messages_read(message_ids):
+    """Mark messages as read on the server in a single request"""
     try:
-        payload = {"token": current_user_token}
-        response = requests.post(
-            f"{SERVER_URL}/mark_read/{message_id}", json=payload, timeout=10
+        response = _session.post(
+            f"{SERVER_URL}/mark_read_batch", json={"ids": message_ids}, timeout=10
         )
         if response.status_code != 200:
-            logger.warning(f"Failed to mark message {message_id} as read")
+            logger.warning(f"Failed to mark messages {message_ids} as read")
     except Exception as e:
-        logger.error(f"Error marking message as read: {e}")
+        logger.error(f"Error marking messages as read: {e}")
 
 
-def process_incoming_messages():
+def process_incoming_messages(wait=0):
     """Process and display incoming messages"""
-    messages = check_messages()
+    _, messages = check_messages(wait)
 
     if messages is None:
         return False  # Session expired
@@ -177,9 +231,22 @@ def process_incoming_messages():
         print("[NONE] No new messages")
         return True
 
+    handle_messages(messages)
+    return True
+
+
+def handle_messages(messages):
+    """Format, read aloud and mark messages as read"""
     print(f"\n[NEW] You have {len(messages)} new message(s)!\n")
 
-    for msg in messages:
+    # Start formatting every message now so AI calls overlap with playback
+    formatted_futures = [
+        _format_pool.submit(format_message_with_ai, msg["sender"], msg["message"])
+        for msg in messages
+    ]
+
+    read_ids = []
+    for msg, future in zip(messages, formatted_futures):
         sender = msg["sender"]
         message = msg["message"]
         msg_id = msg["id"]
@@ -190,22 +257,60 @@ def process_incoming_messages():
 
         # Format with AI
         print("[AI] Processing with AI...")
-        formatted = format_message_with_ai(sender, message)
+        formatted = future.result()
 
         if formatted:
             print(f"[TEXT] AI Output (Text): {formatted}")
-            print(f"[TTS] Playing audio...")
+            print(f"[TTS] Queued for playback...")
             text_to_speech(formatted)
             logger.info(f"Message from {sender} processed and read aloud")
         else:
             print(f"[TEXT] Failed to format, raw message: {message}")
 
         print("-" * 50)
-
-        # Mark as read
-        mark_message_read(msg_id)
-
-    return True
+        read_ids.append(msg_id)
+
+    # Mark as read only once played, so an interrupted run can't lose messages
+    wait_for_speech()
+    mark_messages_read(read_ids)
+
+
+def listen_for_messages():
+    """Handle messages pushed by the server until the session expires"""
+    while True:
+        try:
+            with _session.get(
+                f"{SERVER_URL}/stream_messages",
+                stream=True,
+                headers={"Accept": "text/event-stream"},
+                timeout=(10, STREAM_READ_TIMEOUT),
+            ) as response:
+                if response.status_code == 401:
+                    return False
+                if response.status_code != 200:
+                    logger.warning("Message stream unavailable, using long-polling")
+                    return long_poll_messages()
+
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith("data: "):
+                        handle_messages(orjson.loads(line[len("data: ") :]))
+
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Message stream interrupted: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+
+def long_poll_messages():
+    """Wait on the server for new messages until the session expires"""
+    while True:
+        ok, messages = check_messages(wait=LONG_POLL_WAIT)
+        if messages is None:
+            return False  # Session expired
+        if not ok:
+            # Failed polls return at once; don't hammer a struggling server
+            time.sleep(RECONNECT_DELAY)
+        elif messages:
+            handle_messages(messages)
 
 
 def main():
@@ -221,7 +326,7 @@ def main():
     print("=" * 50)
     print("\nChoose how to check messages:")
     print("1. Check once and exit")
-    print("2. Check continuously (every 5 seconds)")
+    print("2. Check continuously (live updates)")
     print("3. Manual check (press Enter to check, 'quit' to exit)")
 
     mode = input("\nEnter choice (1/2/3): ").strip()
@@ -233,13 +338,9 @@ def main():
 
         elif mode == "2":
             # Check continuously
-            print("Checking for messages every 5 seconds... (Press Ctrl+C to stop)")
-            while True:
-                success = process_incoming_messages()
-                if not success:
-                    print("[ERROR] Session expired. Please login again.")
-                    break
-                time.sleep(5)
+            print("Listening for new messages... (Press Ctrl+C to stop)")
+            if not listen_for_messages():
+                print("[ERROR] Session expired. Please login again.")
 
         elif mode == "3":
             # Manual check
@@ -256,6 +357,9 @@ def main():
         else:
             print("[ERROR] Invalid choice")
 
+        # Let queued messages finish playing before returning
+        flush_speech()
+
     except KeyboardInterrupt:
         print("\n[END] Goodbye!")
         logger.info(f"User {current_username} exited")
@@ -0,0 +1,111 @@
+"""
+Semantic cache for AI message extraction.
+
+Reuses a previous extraction when a new command is a close paraphrase of one
+already seen. Needs the optional faiss and sentence-transformers packages.
+"""
+
+import os
+import re
+import json
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+_NUMBER = re.compile(r"\d+")
+
+
+def _fold(text):
+    """Normalize text for a case-insensitive containment check"""
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+
+def _same_details(cached_entry, text):
+    """Guard against paraphrases that change the recipient, message or numbers"""
+    recipient = cached_entry.get("recipient")
+    message = cached_entry.get("message")
+    if not recipient or not message:
+        return False
+
+    # Usernames are case-sensitive, so the recipient must appear exactly
+    if not re.search(rf"(?<!\w){re.escape(recipient)}(?!\w)", text):
+        return False
+
+    # The cached message is sent as-is, so the user must have actually said it
+    if _fold(message) not in _fold(text):
+        return False
+    return _NUMBER.findall(cached_entry["input"]) == _NUMBER.findall(text)
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of extraction responses keyed by input embedding"""
+
+    def __init__(self, index_file, data_file, threshold=0.92):
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self._faiss = faiss
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
+        self.index_file = index_file
+        self.data_file = data_file
+        self.threshold = threshold
+
+        if os.path.exists(index_file) and os.path.exists(data_file):
+            self.index = faiss.read_index(index_file)
+            with open(data_file, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        else:
+            self.index = faiss.IndexFlatIP(EMBEDDING_DIM)
+            self.entries = []
+
+    def _embed(self, text):
+        """Embed text as a normalized vector (inner product == cosine)"""
+        return self.model.encode([text], normalize_embeddings=True).astype("float32")
+
+    def get(self, text):
+        """Get the cached response for a close paraphrase of text, if any"""
+        if self.index.ntotal == 0:
+            return None
+
+        scores, ids = self.index.search(self._embed(text), 1)
+        if scores[0, 0] < self.threshold:
+            return None
+
+        entry = self.entries[int(ids[0, 0])]
+        if not _same_details(entry, text):
+            return None
+        return entry["response"]
+
+    def add(self, text, response, recipient, message):
+        """Cache a response for text and persist the cache"""
+        self.index.add(self._embed(text))
+        self.entries.append(
+            {
+                "input": text,
+                "response": response,
+                "recipient": recipient,
+                "message": message,
+            }
+        )
+        self.save()
+
+    def save(self):
+        """Write the index and responses to disk"""
+        self._faiss.write_index(self.index, self.index_file)
+        with open(self.data_file, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+
+
+def load_semantic_cache(index_file, data_file, threshold=0.92):
+    """Load the semantic cache, or return None if its dependencies are missing"""
+    try:
+        return SemanticCache(index_file, data_file, threshold)
+    except ImportError as e:
+        logger.warning(f"Semantic cache disabled - missing optional dependency: {e}")
+    except Exception as e:
+        logger.error(f"Semantic cache load error: {e}")
+    return None
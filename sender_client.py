@@ -1,9 +1,20 @@
 import os
+import atexit
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import re
 import logging
+import hashlib
+import sqlite3
+import time
+import unicodedata
+from cachetools import LRUCache
 from mistralai import Mistral
 import config
+from semantic_cache import load_semantic_cache
 from speech_to_text import speech_recognition
 
 # Configuration
@@ -12,12 +23,90 @@ MISTRAL_API_KEY = config.MISTRAL_API_KEY
 SERVER_URL = "http://localhost:5000"
 logger = logging.getLogger(__name__)
 
+# Pooled HTTP session so server calls reuse keep-alive connections
+_http = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+_http.mount("http://", _adapter)
+_http.mount("https://", _adapter)
+
+# Extraction results keyed by normalized command (in memory, backed by disk)
+EXTRACTION_MODEL = "mistral-small-latest"
+_CACHE_KEY_VERSION = 2  # bumped when the key format changes
+_extract_cache = LRUCache(maxsize=512)
+_cache_db = None
+_semantic_cache = None  # False once loading has failed
+
+# Common command shapes that can be parsed without the model, e.g.
+# "tell Jone to come at 4", "message to Bob: hi", "let Amy know that..."
+_DIRECT_COMMANDS = (
+    re.compile(
+        r"^\s*(?:tell|(?:message|text)(?:\s+to)?|send\s+(?:a\s+message\s+)?to)\s+"
+        r"(?P<name>[A-Za-z][\w\-]{1,30})\s*[,:]?\s+(?:(?:to|that)\s+)?"
+        r"(?P<msg>\S.*?)\s*$",
+        re.IGNORECASE | re.DOTALL,
+    ),
+    re.compile(
+        r"^\s*let\s+(?P<name>[A-Za-z][\w\-]{1,30})\s+know\s+(?:that\s+)?"
+        r"(?P<msg>\S.*?)\s*$",
+        re.IGNORECASE | re.DOTALL,
+    ),
+)
+# Words in the name position that aren't a recipient the server knows
+# fmt: off
+_NOT_A_NAME = {
+    # Pronouns and groups
+    "him", "her", "them", "me", "us", "you", "it", "everyone", "everybody", "all",
+    "someone", "somebody",
+    # Prepositions and conjunctions
+    "to", "from", "for", "with", "about", "and", "or",
+    # Articles, determiners and possessives
+    "a", "an", "the", "this", "that", "these", "those", "some",
+    "my", "your", "his", "its", "our", "their",
+}
+# fmt: on
+# A message starting like this probably continues a list of recipients
+_MORE_RECIPIENTS = re.compile(
+    r"(?i:and|or)\b|&|[A-Z][\w\-]*\s*(?:,|&|\b(?i:and|or)\b)"
+)
+
+# One Mistral client (and its connection pool) shared by every extraction
+_mistral = Mistral(api_key=MISTRAL_API_KEY)
+atexit.register(_mistral.__exit__, None, None, None)
+
+_PROMPT_TMPL = (
+    "Extract the recipient name and the message from this command:\n"
+    '"{}"\n'
+    "\n"
+    "Respond ONLY in this exact JSON format:\n"
+    '{{"recipient": "name", "message": "the actual message"}}\n'
+    "\n"
+    'Example: If input is "Tell Jone to come at 4 pm today."\n'
+    'Output: {{"recipient": "Jone", "message": "come at 4 pm today."}}'
+)
+
 # Session variables
 current_user_token = None
 current_user_id = None
 current_username = None
 
 
+def _json(response):
+    """Decode a JSON response body with orjson"""
+    return orjson.loads(response.content)
+
+
+def _error_message(response, default):
+    """Get the error message from a failed response, even if it isn't JSON"""
+    try:
+        return _json(response).get("error", default)
+    except (orjson.JSONDecodeError, AttributeError):
+        return default
+
+
 def authenticate_user():
     """Handle user signup/login"""
     global current_user_token, current_user_id, current_username
@@ -48,7 +137,7 @@ def signup_user():
     try:
         payload = {"username": username, "password": password, "email": email}
 
-        response = requests.post(f"{SERVER_URL}/signup", json=payload, timeout=10)
+        response = _http.post(f"{SERVER_URL}/signup", json=payload, timeout=10)
 
         if response.status_code == 201:
             print("[SUCCESS] Account created successfully!")
@@ -56,7 +145,7 @@ def signup_user():
             # Auto login after signup
             return login_with_credentials(username, password)
         else:
-            error_msg = response.json().get("error", "Signup failed")
+            error_msg = _error_message(response, "Signup failed")
             print(f"[ERROR] Signup failed: {error_msg}")
             logger.warning(f"Signup failed: {error_msg}")
             return False
@@ -84,19 +173,20 @@ def login_with_credentials(username, password):
     try:
         payload = {"username": username, "password": password}
 
-        response = requests.post(f"{SERVER_URL}/login", json=payload, timeout=10)
+        response = _http.post(f"{SERVER_URL}/login", json=payload, timeout=10)
 
         if response.status_code == 200:
-            data = response.json()
+            data = _json(response)
             current_user_token = data.get("token")
             current_user_id = data.get("user_id")
             current_username = data.get("username")
+            _http.headers["Authorization"] = f"Bearer {current_user_token}"
 
             print(f"\n[SUCCESS] Welcome {current_username}!")
             logger.info(f"User {username} logged in successfully")
             return True
         else:
-            error_msg = response.json().get("error", "Login failed")
+            error_msg = _error_message(response, "Login failed")
             print(f"[ERROR] Login failed: {error_msg}")
             logger.warning(f"Login failed for user {username}")
             return False
@@ -106,31 +196,188 @@ def login_with_credentials(username, password):
         return False
 
 
-def extract_message_details(user_input):
-    """Use Mistral AI to extract recipient and message from voice/text input"""
+def _normalize_command(user_input):
+    """Normalize a command so trivially different inputs share a cache entry"""
+    # Case is kept: usernames are case-sensitive, so "Bob" and "bob" differ
+    normalized = unicodedata.normalize("NFC", user_input).strip()
+    return " ".join(normalized.split())
 
-    try:
-        with Mistral(api_key=MISTRAL_API_KEY) as mistral:
-            prompt = f"""
-            Extract the recipient name and the message from this command:
-            "{user_input}"
-            
-            Respond ONLY in this exact JSON format:
-            {{"recipient": "name", "message": "the actual message"}}
-            
-            Example: If input is "Tell Jone to come at 4 pm today."
-            Output: {{"recipient": "Jone", "message": "come at 4 pm today."}}
+
+def _cache_key(user_input):
+    """Build the extraction cache key for a command"""
+    key = f"v{_CACHE_KEY_VERSION}\n{EXTRACTION_MODEL}\n{_normalize_command(user_input)}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _get_cache_db():
+    """Open the on-disk extraction cache"""
+    global _cache_db
+
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(config.LLM_CACHE_FILE)
+        _cache_db.execute(
             """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                ts INTEGER NOT NULL
+            )
+        """
+        )
+    return _cache_db
 
-            res = mistral.chat.complete(
-                model="mistral-small-latest",
-                messages=[{"content": prompt, "role": "user"}],
-                stream=False,
+
+def _cache_get(key):
+    """Get a cached extraction result from memory or disk"""
+    response = _extract_cache.get(key)
+    if response is not None:
+        return response
+
+    try:
+        row = (
+            _get_cache_db()
+            .execute(
+                "SELECT response FROM responses WHERE key = ? AND ts > ?",
+                (key, int(time.time()) - config.LLM_CACHE_TTL),
+            )
+            .fetchone()
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Extraction cache read error: {e}")
+        return None
+
+    if row:
+        _extract_cache[key] = row[0]
+        return row[0]
+    return None
+
+
+def _cache_put(key, response):
+    """Store an extraction result in memory and on disk"""
+    _extract_cache[key] = response
+
+    try:
+        cache_db = _get_cache_db()
+        with cache_db:
+            cache_db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, ts) VALUES (?, ?, ?)",
+                (key, response, int(time.time())),
             )
+    except sqlite3.Error as e:
+        logger.warning(f"Extraction cache write error: {e}")
+
+
+def _get_semantic_cache():
+    """Load the optional semantic cache on first use"""
+    global _semantic_cache
+
+    if not config.SEMANTIC_CACHE_ENABLED:
+        return None
 
-            # Extract the AI response
-            ai_response = res.choices[0].message.content
-            return ai_response
+    if _semantic_cache is None:
+        _semantic_cache = (
+            load_semantic_cache(
+                config.SEMANTIC_CACHE_INDEX_FILE,
+                config.SEMANTIC_CACHE_DATA_FILE,
+                config.SEMANTIC_CACHE_THRESHOLD,
+            )
+            or False
+        )
+    return _semantic_cache or None
+
+
+def parse_ai_response(ai_response):
+    """Parse the AI JSON response, stripping markdown code fences"""
+    cleaned_data = ai_response.strip()
+    if cleaned_data.startswith("```json"):
+        cleaned_data = cleaned_data.replace("```json", "").replace("```", "").strip()
+    elif cleaned_data.startswith("```"):
+        cleaned_data = cleaned_data.replace("```", "").strip()
+
+    return json.loads(cleaned_data)
+
+
+def _extracted_details(ai_response):
+    """Get (recipient, message) if an AI response holds both, else None"""
+    try:
+        data = parse_ai_response(ai_response)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not data.get("recipient"):
+        return None
+    if not data.get("message"):
+        return None
+    return data["recipient"], data["message"]
+
+
+def _match_direct_command(user_input):
+    """Extract recipient and message from a simple command, or return None"""
+    for pattern in _DIRECT_COMMANDS:
+        match = pattern.match(user_input)
+        if not match:
+            continue
+        # Leave anything ambiguous to the AI rather than guess
+        if match["name"].lower() in _NOT_A_NAME or _MORE_RECIPIENTS.match(
+            match["msg"]
+        ):
+            return None
+        return json.dumps({"recipient": match["name"], "message": match["msg"]})
+    return None
+
+
+def extract_message_details(user_input):
+    """Use Mistral AI to extract recipient and message from voice/text input"""
+
+    # Simple commands don't need the model
+    direct_response = _match_direct_command(user_input)
+    if direct_response is not None:
+        logger.info("Message details extracted without AI")
+        return direct_response
+
+    key = _cache_key(user_input)
+    cached_response = _cache_get(key)
+    if cached_response is not None:
+        logger.info("AI extraction served from cache")
+        return cached_response
+
+    semantic_cache = _get_semantic_cache()
+    if semantic_cache:
+        try:
+            cached_response = semantic_cache.get(_normalize_command(user_input))
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup error: {e}")
+        if cached_response is not None:
+            logger.info("AI extraction served from semantic cache")
+            _cache_put(key, cached_response)
+            return cached_response
+
+    try:
+        # Stream the answer so reading can stop once the JSON is complete
+        chunks = []
+        with _mistral.chat.stream(
+            model=EXTRACTION_MODEL,
+            messages=[{"content": _PROMPT_TMPL.format(user_input), "role": "user"}],
+        ) as stream:
+            for event in stream:
+                content = event.data.choices[0].delta.content or ""
+                chunks.append(content)
+                if "}" in content and _extracted_details("".join(chunks)):
+                    break
+
+        ai_response = "".join(chunks)
+
+        # Only cache usable answers so a bad response can be retried
+        details = _extracted_details(ai_response)
+        if details:
+            _cache_put(key, ai_response)
+            if semantic_cache:
+                try:
+                    semantic_cache.add(
+                        _normalize_command(user_input), ai_response, *details
+                    )
+                except Exception as e:
+                    logger.warning(f"Semantic cache update error: {e}")
+        return ai_response
     except Exception as e:
         logger.error(f"AI extraction error: {e}")
         print(f"❌ Error processing with AI: {e}")
@@ -140,16 +387,16 @@ def extract_message_details(user_input):
 def send_message_to_server(recipient, message):
     """Send the extracted message to the server with authentication"""
 
-    payload = {"token": current_user_token, "recipient": recipient, "message": message}
+    payload = {"recipient": recipient, "message": message}
 
     try:
-        response = requests.post(f"{SERVER_URL}/send_message", json=payload, timeout=10)
+        response = _http.post(f"{SERVER_URL}/send_message", json=payload, timeout=10)
         if response.status_code == 200:
             print("[SUCCESS] Message sent successfully!")
             logger.info(f"Message sent from {current_username} to {recipient}")
             return True
         else:
-            error_msg = response.json().get("error", "Failed to send message")
+            error_msg = _error_message(response, "Failed to send message")
             print(f"[ERROR] Error: {error_msg}")
             logger.warning(f"Failed to send message: {error_msg}")
             return False
@@ -204,15 +451,7 @@ def main():
 
             # Parse the JSON response - clean markdown formatting
             try:
-                cleaned_data = extracted_data.strip()
-                if cleaned_data.startswith("```json"):
-                    cleaned_data = (
-                        cleaned_data.replace("```json", "").replace("```", "").strip()
-                    )
-                elif cleaned_data.startswith("```"):
-                    cleaned_data = cleaned_data.replace("```", "").strip()
-
-                data = json.loads(cleaned_data)
+                data = parse_ai_response(extracted_data)
                 recipient = data.get("recipient")
                 message = data.get("message")
 
@@ -1,6 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
 import logging
 from config import logger, DATABASE
 from database import (
@@ -8,12 +12,87 @@ from database import (
     register_user,
     login_user,
     verify_session_token,
+    invalidate_session_token,
     log_activity,
+    record_message,
     get_user_by_username,
     get_db_connection,
+    release_db_connection,
+    fetch_tuples,
 )
 
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (faster for large message lists)"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Pooled connections outlive requests, so never leave a transaction open
+app.teardown_appcontext(release_db_connection)
+
+# Longest time a long-poll or idle stream waits before re-checking the database
+LONG_POLL_MAX_WAIT = 30  # seconds
+STREAM_KEEPALIVE_INTERVAL = 15  # seconds
+
+# Bumped on every stored message to wake waiting long-poll/stream requests
+_message_event = threading.Condition()
+_message_seq = 0
+
+# SQL statements (constant strings so the connection's statement cache hits)
+_Q_UNREAD_MESSAGES = """
+    SELECT m.id, u.username as sender, m.message, m.created_at
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.recipient_id = ? AND m.is_read = 0 AND m.id > ?
+    ORDER BY m.created_at DESC, m.id DESC
+"""
+_Q_MARK_READ = (
+    "UPDATE messages SET is_read = 1, read_at = ? WHERE id = ? AND recipient_id = ?"
+)
+_Q_MARK_READ_BATCH = """
+    UPDATE messages SET is_read = 1, read_at = ?
+    WHERE id IN (SELECT value FROM json_each(?)) AND recipient_id = ?
+"""
+_Q_CONVERSATION = """
+    SELECT m.id, u.username as sender, m.message, m.is_read, m.created_at
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE (m.sender_id = ? AND m.recipient_id = ?)
+       OR (m.sender_id = ? AND m.recipient_id = ?)
+    ORDER BY m.created_at ASC, m.id ASC
+"""
+_Q_CONVERSATION_PAGE = """
+    SELECT m.id, u.username as sender, m.message, m.is_read, m.created_at,
+           COUNT(*) OVER () as total
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE (m.sender_id = ? AND m.recipient_id = ?)
+       OR (m.sender_id = ? AND m.recipient_id = ?)
+    ORDER BY m.created_at DESC, m.id DESC
+    LIMIT ? OFFSET ?
+"""
+_Q_CONVERSATION_COUNT = """
+    SELECT COUNT(*) as total FROM messages m
+    WHERE (m.sender_id = ? AND m.recipient_id = ?)
+       OR (m.sender_id = ? AND m.recipient_id = ?)
+"""
+_Q_CONTACTS = """
+    SELECT id, username, email, created_at FROM users
+    WHERE is_active = 1 AND id != ?
+    ORDER BY username ASC
+"""
+_Q_REGISTER_DEVICE = """
+    INSERT OR REPLACE INTO device_tokens (user_id, device_token, registered_at)
+    VALUES (?, ?, ?)
+"""
 
 
 def get_client_ip():
@@ -21,6 +100,58 @@ def get_client_ip():
     return request.environ.get("REMOTE_ADDR", "Unknown")
 
 
+def get_request_token():
+    """Get session token from the Authorization header, query string or JSON body"""
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header[len("Bearer ") :].strip()
+
+    data = request.get_json(silent=True) or {}
+    return request.args.get("token") or data.get("token")
+
+
+def now_ms():
+    """Current time as integer Unix milliseconds (how message times are stored)"""
+    return time.time_ns() // 1_000_000
+
+
+def format_timestamp(ms):
+    """Format a stored Unix millisecond timestamp as ISO 8601 UTC for JSON"""
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat()
+
+
+def notify_new_message():
+    """Wake requests waiting for new messages"""
+    global _message_seq
+    with _message_event:
+        _message_seq += 1
+        _message_event.notify_all()
+
+
+def wait_for_new_message(seq, timeout):
+    """Wait until a message newer than seq is stored; return the latest seq"""
+    with _message_event:
+        _message_event.wait_for(lambda: _message_seq != seq, timeout)
+        return _message_seq
+
+
+def fetch_unread_messages(user_id, after_id=0):
+    """Get unread messages for a user, optionally only those after a message ID"""
+    messages = fetch_tuples(_Q_UNREAD_MESSAGES, (user_id, after_id))
+
+    return [
+        {
+            "id": i,
+            "sender": sender,
+            "message": message,
+            "timestamp": format_timestamp(created_at),
+        }
+        for i, sender, message, created_at in messages
+    ]
+
+
 # ==================== Authentication Endpoints ====================
 
 
@@ -109,6 +240,29 @@ def login():
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route("/logout", methods=["POST"])
+def logout():
+    """Invalidate the current session token"""
+    try:
+        token = get_request_token()
+
+        # Verify token
+        valid, user = verify_session_token(token)
+        if not valid:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        if not invalidate_session_token(token):
+            return jsonify({"error": "Internal server error"}), 500
+
+        logger.info(f"User logged out: {user['username']} from {get_client_ip()}")
+        log_activity(user["id"], "user_logout", None, get_client_ip())
+        return jsonify({"status": "success"}), 200
+
+    except Exception as e:
+        logger.error(f"Logout endpoint error: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
 # ==================== Message Endpoints ====================
 
 
@@ -117,7 +271,7 @@ def send_message():
     """Send message between authenticated users"""
     try:
         data = request.json or {}
-        token = data.get("token")
+        token = get_request_token()
         recipient = (data.get("recipient") or "").strip()
         message = (data.get("message") or "").strip()
 
@@ -143,17 +297,19 @@ def send_message():
             )
             return jsonify({"error": "Recipient user not found"}), 404
 
-        # Store message
-        conn = get_db_connection()
-        conn.execute(
-            "INSERT INTO messages (sender_id, recipient_id, message) VALUES (?, ?, ?)",
-            (user["id"], recipient_user["id"], message),
-        )
-        conn.commit()
-        conn.close()
+        # Store message and its activity log row together
+        if not record_message(
+            user["id"],
+            recipient_user["id"],
+            message,
+            now_ms(),
+            f"To: {recipient}",
+            get_client_ip(),
+        ):
+            return jsonify({"error": "Failed to store message"}), 500
+        notify_new_message()
 
         logger.info(f"Message sent from {user['username']} to {recipient}")
-        log_activity(user["id"], "send_message", f"To: {recipient}", get_client_ip())
 
         return (
             jsonify(
@@ -174,7 +330,7 @@ def send_message():
 def get_messages():
     """Retrieve unread messages for authenticated user"""
     try:
-        token = request.args.get("token")
+        token = get_request_token()
 
         # Verify token
         valid, user = verify_session_token(token)
@@ -184,28 +340,17 @@ def get_messages():
             )
             return jsonify({"error": "Unauthorized - Invalid or expired token"}), 401
 
-        conn = get_db_connection()
-        messages = conn.execute(
-            """SELECT m.id, u.username as sender, m.message, m.created_at 
-               FROM messages m
-               JOIN users u ON m.sender_id = u.id
-               WHERE m.recipient_id = ? AND m.is_read = 0
-               ORDER BY m.created_at DESC""",
-            (user["id"],),
-        ).fetchall()
-
-        message_list = []
-        for msg in messages:
-            message_list.append(
-                {
-                    "id": msg["id"],
-                    "sender": msg["sender"],
-                    "message": msg["message"],
-                    "timestamp": msg["created_at"],
-                }
-            )
-
-        conn.close()
+        # Long-poll: optionally block until a message arrives
+        wait = request.args.get("wait", default=0, type=float)
+        wait = min(max(wait, 0), LONG_POLL_MAX_WAIT)
+        seq = _message_seq
+        message_list = fetch_unread_messages(user["id"])
+        deadline = time.monotonic() + wait
+        while not message_list and time.monotonic() < deadline:
+            # Wake periodically so messages stored by other workers arrive too
+            remaining = deadline - time.monotonic()
+            seq = wait_for_new_message(seq, min(remaining, STREAM_KEEPALIVE_INTERVAL))
+            message_list = fetch_unread_messages(user["id"])
 
         logger.info(
             f"Retrieved {len(message_list)} messages for user {user['username']}"
@@ -217,19 +362,74 @@ def get_messages():
             get_client_ip(),
         )
 
-        return jsonify({"messages": message_list}), 200
+        return jsonify({"messages": message_list})
 
     except Exception as e:
         logger.error(f"Get messages error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/stream_messages", methods=["GET"])
+def stream_messages():
+    """Push new unread messages to the client as server-sent events"""
+    try:
+        token = get_request_token()
+
+        # Verify token
+        valid, user = verify_session_token(token)
+        if not valid:
+            logger.warning(
+                f"Stream messages attempt with invalid token from {get_client_ip()}"
+            )
+            return jsonify({"error": "Unauthorized - Invalid or expired token"}), 401
+
+        def generate():
+            last_id = 0
+            last_sent = time.monotonic()
+            while True:
+                seq = _message_seq
+                # Everything pending goes out as one event (a list, oldest first)
+                messages = fetch_unread_messages(user["id"], last_id)
+                if messages:
+                    messages.reverse()
+                    last_id = max(last_id, *(msg["id"] for msg in messages))
+                    yield f"data: {app.json.dumps(messages)}\n\n"
+                    last_sent = time.monotonic()
+
+                # Wake-ups fire for every stored message, so keep-alives are
+                # timed from the last write rather than sent only on timeouts
+                if time.monotonic() - last_sent >= STREAM_KEEPALIVE_INTERVAL:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+
+                # Re-check periodically so messages stored by other workers arrive too
+                idle = time.monotonic() - last_sent
+                wait_for_new_message(seq, STREAM_KEEPALIVE_INTERVAL - idle)
+
+                # End the stream once the session is logged out or expires
+                if not verify_session_token(token)[0]:
+                    logger.info(f"Message stream closed for user {user['username']}")
+                    return
+
+        logger.info(f"Message stream opened for user {user['username']}")
+        log_activity(user["id"], "stream_messages", None, get_client_ip())
+
+        return Response(
+            generate(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    except Exception as e:
+        logger.error(f"Stream messages error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/mark_read/<int:message_id>", methods=["POST"])
 def mark_read(message_id):
     """Mark a message as read"""
     try:
-        data = request.json
-        token = data.get("token")
+        token = get_request_token()
 
         # Verify token
         valid, user = verify_session_token(token)
@@ -240,12 +440,7 @@ def mark_read(message_id):
             return jsonify({"error": "Unauthorized"}), 401
 
         conn = get_db_connection()
-        conn.execute(
-            "UPDATE messages SET is_read = 1, read_at = ? WHERE id = ? AND recipient_id = ?",
-            (datetime.now(), message_id, user["id"]),
-        )
-        conn.commit()
-        conn.close()
+        conn.execute(_Q_MARK_READ, (now_ms(), message_id, user["id"]))
 
         logger.info(f"Message {message_id} marked as read by user {user['username']}")
         log_activity(
@@ -261,11 +456,56 @@ def mark_read(message_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/mark_read_batch", methods=["POST"])
+def mark_read_batch():
+    """Mark several messages as read in one request"""
+    try:
+        data = request.get_json(silent=True) or {}
+        token = get_request_token()
+        message_ids = data.get("ids") or []
+
+        # Verify token
+        valid, user = verify_session_token(token)
+        if not valid:
+            logger.warning(
+                f"Mark read batch attempt with invalid token from {get_client_ip()}"
+            )
+            return jsonify({"error": "Unauthorized"}), 401
+
+        if not isinstance(message_ids, list) or not all(
+            type(message_id) is int for message_id in message_ids  # not bool
+        ):
+            return jsonify({"error": "ids must be a list of message IDs"}), 400
+
+        if not message_ids:
+            return jsonify({"status": "success", "updated": 0}), 200
+
+        # IDs go in as one JSON array so the statement text never changes
+        conn = get_db_connection()
+        updated = conn.execute(
+            _Q_MARK_READ_BATCH,
+            (now_ms(), orjson.dumps(message_ids).decode(), user["id"]),
+        ).rowcount
+
+        logger.info(f"{updated} messages marked as read by user {user['username']}")
+        log_activity(
+            user["id"],
+            "mark_message_read",
+            f"Message IDs: {', '.join(map(str, message_ids))}",
+            get_client_ip(),
+        )
+
+        return jsonify({"status": "success", "updated": updated}), 200
+    except Exception as e:
+        logger.error(f"Mark read batch error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/get_conversation/<recipient_username>", methods=["GET"])
 def get_conversation(recipient_username):
     """Get conversation history between two users"""
     try:
-        token = request.args.get("token")
+        token = get_request_token()
 
         # Verify token
         valid, user = verify_session_token(token)
@@ -282,30 +522,21 @@ def get_conversation(recipient_username):
             )
             return jsonify({"error": "User not found"}), 404
 
-        conn = get_db_connection()
-        messages = conn.execute(
-            """SELECT m.id, u.username as sender, m.message, m.is_read, m.created_at 
-               FROM messages m
-               JOIN users u ON m.sender_id = u.id
-               WHERE (m.sender_id = ? AND m.recipient_id = ?) 
-                  OR (m.sender_id = ? AND m.recipient_id = ?)
-               ORDER BY m.created_at ASC""",
+        messages = fetch_tuples(
+            _Q_CONVERSATION,
             (user["id"], recipient_user["id"], recipient_user["id"], user["id"]),
-        ).fetchall()
-
-        message_list = []
-        for msg in messages:
-            message_list.append(
-                {
-                    "id": msg["id"],
-                    "sender": msg["sender"],
-                    "message": msg["message"],
-                    "is_read": msg["is_read"],
-                    "timestamp": msg["created_at"],
-                }
-            )
+        )
 
-        conn.close()
+        message_list = [
+            {
+                "id": i,
+                "sender": sender,
+                "message": message,
+                "is_read": is_read,
+                "timestamp": format_timestamp(created_at),
+            }
+            for i, sender, message, is_read, created_at in messages
+        ]
 
         logger.info(
             f"Retrieved conversation between {user['username']} and {recipient_username}"
@@ -317,7 +548,7 @@ def get_conversation(recipient_username):
             get_client_ip(),
         )
 
-        return jsonify({"conversation": message_list}), 200
+        return jsonify({"conversation": message_list})
 
     except Exception as e:
         logger.error(f"Get conversation error: {e}")
@@ -331,7 +562,7 @@ def get_conversation(recipient_username):
 def get_all_users():
     """Get list of all users (for contact list)"""
     try:
-        token = request.args.get("token")
+        token = get_request_token()
 
         # Verify token
         valid, user = verify_session_token(token)
@@ -341,29 +572,15 @@ def get_all_users():
             )
             return jsonify({"error": "Unauthorized"}), 401
 
-        conn = get_db_connection()
-        users = conn.execute(
-            """SELECT id, username, email, created_at FROM users 
-               WHERE is_active = 1 AND id != ?
-               ORDER BY username ASC""",
-            (user["id"],),
-        ).fetchall()
-
-        user_list = []
-        for u in users:
-            user_list.append(
-                {
-                    "id": u["id"],
-                    "username": u["username"],
-                    "email": u["email"],
-                    "joined_at": u["created_at"],
-                }
-            )
+        users = fetch_tuples(_Q_CONTACTS, (user["id"],))
 
-        conn.close()
+        user_list = [
+            {"id": i, "username": username, "email": email, "joined_at": created_at}
+            for i, username, email, created_at in users
+        ]
 
         logger.info(f"User {user['username']} retrieved contacts list")
-        return jsonify({"users": user_list}), 200
+        return jsonify({"users": user_list})
 
     except Exception as e:
         logger.error(f"Get users error: {e}")
@@ -374,7 +591,7 @@ def get_all_users():
 def get_user_profile():
     """Get current user profile"""
     try:
-        token = request.args.get("token")
+        token = get_request_token()
 
         # Verify token
         valid, user = verify_session_token(token)
@@ -406,7 +623,7 @@ def register_device():
     """Register device for push notifications"""
     try:
         data = request.json or {}
-        token = data.get("token")
+        token = get_request_token()
         device_token = data.get("device_token")
 
         # Verify token
@@ -419,13 +636,7 @@ def register_device():
 
         # Store device token (in production, use proper push notification service)
         conn = get_db_connection()
-        conn.execute(
-            """INSERT OR REPLACE INTO device_tokens (user_id, device_token, registered_at)
-               VALUES (?, ?, ?)""",
-            (user["id"], device_token, datetime.now()),
-        )
-        conn.commit()
-        conn.close()
+        conn.execute(_Q_REGISTER_DEVICE, (user["id"], device_token, now_ms()))
 
         logger.info(f"Device registered for user {user['username']}")
         return jsonify({"status": "success"}), 200
@@ -439,7 +650,7 @@ def register_device():
 def get_conversation_v2(recipient_username):
     """Get full conversation history with pagination (for mobile app)"""
     try:
-        token = request.args.get("token")
+        token = get_request_token()
         limit = request.args.get("limit", default=50, type=int)
         offset = request.args.get("offset", default=0, type=int)
 
@@ -452,52 +663,43 @@ def get_conversation_v2(recipient_username):
         if not recipient_user:
             return jsonify({"error": "User not found"}), 404
 
-        conn = get_db_connection()
-        
-        # Get total count
-        count = conn.execute(
-            """SELECT COUNT(*) as total FROM messages m
-               WHERE (m.sender_id = ? AND m.recipient_id = ?) 
-                  OR (m.sender_id = ? AND m.recipient_id = ?)""",
-            (user["id"], recipient_user["id"], recipient_user["id"], user["id"]),
-        ).fetchone()["total"]
-
-        # Get paginated messages
-        messages = conn.execute(
-            """SELECT m.id, u.username as sender, m.message, m.is_read, m.created_at 
-               FROM messages m
-               JOIN users u ON m.sender_id = u.id
-               WHERE (m.sender_id = ? AND m.recipient_id = ?) 
-                  OR (m.sender_id = ? AND m.recipient_id = ?)
-               ORDER BY m.created_at DESC
-               LIMIT ? OFFSET ?""",
-            (user["id"], recipient_user["id"], recipient_user["id"], user["id"], limit, offset),
-        ).fetchall()
-
-        message_list = []
-        for msg in messages:
-            message_list.append(
-                {
-                    "id": msg["id"],
-                    "sender": msg["sender"],
-                    "is_own_message": msg["sender"] == user["username"],
-                    "message": msg["message"],
-                    "is_read": msg["is_read"],
-                    "timestamp": msg["created_at"],
-                }
-            )
+        pair = (user["id"], recipient_user["id"], recipient_user["id"], user["id"])
 
-        conn.close()
+        # Get paginated messages with the total count in the same pass
+        messages = fetch_tuples(_Q_CONVERSATION_PAGE, (*pair, limit, offset))
 
-        return (
-            jsonify(
-                {
-                    "conversation": message_list[::-1],  # Reverse to show oldest first
-                    "total_messages": count,
-                    "has_more": offset + limit < count,
-                }
-            ),
-            200,
+        if messages:
+            count = messages[0][-1]
+        elif offset > 0:
+            # Page past the end: count separately so has_more/total stay accurate
+            count = (
+                get_db_connection()
+                .execute(_Q_CONVERSATION_COUNT, pair)
+                .fetchone()["total"]
+            )
+        else:
+            count = 0
+
+        username = user["username"]
+        message_list = [
+            {
+                "id": i,
+                "sender": sender,
+                "is_own_message": sender == username,
+                "message": message,
+                "is_read": is_read,
+                "timestamp": format_timestamp(created_at),
+            }
+            for i, sender, message, is_read, created_at, _total in messages
+        ]
+        message_list.reverse()  # Show oldest first
+
+        return jsonify(
+            {
+                "conversation": message_list,
+                "total_messages": count,
+                "has_more": offset + limit < count,
+            }
         )
 
     except Exception as e:
@@ -515,4 +717,4 @@ def health_check():
 if __name__ == "__main__":
     init_db()
     logger.info("[START] AI Messenger Server starting...")
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    app.run(debug=False, threaded=True, host="0.0.0.0", port=5000)
@@ -1,18 +1,45 @@
+import atexit
 import speech_recognition as sr
 
 r = sr.Recognizer()
 
+# Microphone stream is opened and calibrated once, then reused for every call
+_mic = None
+_stream = None
+
+
+def _close_microphone():
+    global _mic, _stream
+
+    if _mic is not None:
+        _mic.__exit__(None, None, None)
+        _mic = None
+        _stream = None
+
+
+def _get_stream():
+    global _mic, _stream
+
+    if _stream is None:
+        _mic = sr.Microphone()
+        _stream = _mic.__enter__()
+        r.adjust_for_ambient_noise(_stream, duration=0.5)
+        r.dynamic_energy_threshold = False
+        atexit.register(_close_microphone)
+    return _stream
+
+
 def speech_recognition():
-    with sr.Microphone() as mic_source:
+    try:
+        stream = _get_stream()
         print("Tell youe message")
-        audio_text = r.listen(mic_source)
-
-        try:
-            message = r.recognize_google(audio_text)
-            print("Message = " + message)
-        except:
-            print("Sorry, I did not get that")
-    return message
+        audio_text = r.listen(stream, phrase_time_limit=10)
+        message = r.recognize_google(audio_text)
+        print("Message = " + message)
+        return message
+    except Exception:
+        print("Sorry, I did not get that")
+        return None
 
 # if __name__ == "__main__":
-#     speech_to_text()
\ No newline at end of file
+#     speech_to_text()
@@ -1,23 +1,95 @@
+import queue
+import threading
 import pyttsx3
 
-def text_to_speech(text):
-    try:
+# Speech is queued and played by a background worker that owns the engine
+_engine = None
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+_STOP = object()
+
+# Number of queued texts not yet played
+_pending = 0
+_pending_done = threading.Condition()
+
+
+def _get_engine():
+    global _engine
+
+    if _engine is None:
         engine = pyttsx3.init()
 
         voices = engine.getProperty('voices')
-        engine.setProperty('voice', voices[1].id)  # 0 for male, 1 for female (depends on system)
+        voice = voices[1 if len(voices) > 1 else 0]  # 0 for male, 1 for female (depends on system)
+        engine.setProperty('voice', voice.id)
         engine.setProperty('rate', 150)  # Speed of speech
         engine.setProperty('volume', 1.0)  # Volume (0.0 to 1.0)
 
-        engine.say(text)
-        engine.runAndWait()
+        _engine = engine
+    return _engine
+
+
+def _speak_queued():
+    global _engine, _pending
+
+    while True:
+        text = _queue.get()
+        if text is _STOP:
+            break
+
+        try:
+            engine = _get_engine()
+            engine.say(text)
+            engine.runAndWait()
+
+        except Exception as e:
+            print(f"Error: {e}")
+
+        with _pending_done:
+            _pending -= 1
+            _pending_done.notify_all()
+
+    # The engine belongs to this thread; a restarted worker creates its own
+    _engine = None
+
+
+def text_to_speech(text):
+    """Queue text to be spoken without blocking the caller"""
+    global _worker, _pending
+
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_speak_queued, daemon=True)
+            _worker.start()
+        with _pending_done:
+            _pending += 1
+        _queue.put(text)
+
+
+def wait():
+    """Block until all queued speech has been played, keeping the worker running"""
+    with _pending_done:
+        # Short waits keep Ctrl+C responsive on Windows
+        while _pending:
+            _pending_done.wait(0.2)
+
+
+def flush():
+    """Wait until all queued speech has been played, then stop the worker"""
+    global _worker
 
-    except Exception as e:
-        print(f"Error: {e}")
+    with _worker_lock:
+        if _worker is None:
+            return
+        _queue.put(_STOP)
+        _worker.join()
+        _worker = None
 
 if __name__ == "__main__":
     user_text = "hello".strip()
     if user_text:
         text_to_speech(user_text)
+        flush()
     else:
         print("No text entered.")
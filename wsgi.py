@@ -0,0 +1,10 @@
+"""
+WSGI entry point for running the server under a production server, e.g.:
+
+    gunicorn -w 4 -k gthread --threads 16 --bind 0.0.0.0:5000 wsgi:app
+"""
+
+from server import app
+from database import init_db
+
+init_db()